@@ -0,0 +1,462 @@
+"""Multi process load test of managers, end to end.
+
+Starts a local firebase stand-in (an https server keeping data in memory,
+with injected latency), then for each worker count spawns that many
+processes. Each process has its own engine, session, Adaptor and managers,
+and replays a random mix of add, push, set, get and delete for a while.
+Latency histograms of every operation, of the firebase calls (Adaptor._call,
+including time in the scheduler) and of sql commits (Adaptor._write and
+delete) are merged across processes and printed per worker count, so you
+can see whether the sql commit or the http path saturates first.
+
+    python benchmarks/load.py --workers 1,2,4,8 --duration 10 \\
+        --mix add:1,push:4,set:2,get:4,delete:1 --latency 20 --jitter 30
+
+By default sql goes to a sqlite file in a temp directory, whose single
+writer lock saturates quickly; use --db-url to point at postgres instead.
+Needs cryptography to generate the certificate of the stand-in.
+"""
+import os
+import ssl
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+import threading
+import multiprocessing
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote
+
+from sqlalchemy import create_engine, Column, Integer, String
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.declarative import declarative_base
+
+from firebase_alchemy.mixin import FireMix
+from firebase_alchemy.manager import Adaptor, ModelManager, SyncManager
+from firebase_alchemy.scheduler import Scheduler
+from firebase_alchemy.hedge import Hedger
+
+OPERATIONS = ['add', 'push', 'set', 'get', 'delete']
+PHASES = ['http', 'sql']
+FIREPATH = 'load/chats'
+GRACE = 120 # seconds workers may take to set up, or to report after a round
+
+Base = declarative_base()
+
+class Chat(Base, FireMix):
+    __tablename__ = 'load_chats'
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+
+# ---- Histogram ----
+BUCKETS_PER_DOUBLING = 8 # ~9% resolution
+
+def record(histogram, seconds):
+    """add a latency to a histogram. key: bucket, value: count
+    """
+    micros = max(seconds * 1e6, 1)
+    bucket = int(math.log(micros, 2) * BUCKETS_PER_DOUBLING)
+    histogram[bucket] = histogram.get(bucket, 0) + 1
+
+def merge(histogram, other):
+    for bucket, count in other.items():
+        histogram[bucket] = histogram.get(bucket, 0) + count
+
+def percentile(histogram, p):
+    """upper bound in ms of the bucket holding the p-th percentile
+    """
+    total = sum(histogram.values())
+    if not total:
+        return float('nan')
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= total * p / 100.0:
+            return 2 ** ((bucket + 1) / float(BUCKETS_PER_DOUBLING)) / 1000.0
+
+# ---- Firebase stand-in ----
+class _Store(object):
+    """in memory json tree with firebase rest semantics
+    """
+    def __init__(self):
+        self.root = {}
+        self.lock = threading.Lock()
+        self.pushes = 0
+
+    def get(self, keys):
+        with self.lock:
+            node = self.root
+            for key in keys:
+                if not isinstance(node, dict) or key not in node:
+                    return None
+                node = node[key]
+            return node
+
+    def set(self, keys, value):
+        with self.lock:
+            if not keys:
+                self.root = value if isinstance(value, dict) else {}
+                return
+            node = self.root
+            for key in keys[:-1]:
+                if not isinstance(node.get(key), dict):
+                    if value is None:
+                        return
+                    node[key] = {}
+                node = node[key]
+            if value is None:
+                node.pop(keys[-1], None)
+            else:
+                node[keys[-1]] = value
+
+    def push(self, keys, value):
+        with self.lock:
+            self.pushes += 1
+            name = '-L{:013d}{:08d}'.format(int(time.time() * 1000), self.pushes)
+        self.set(keys + [name], value)
+        return name
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    wbufsize = -1 # one write per response, flushed by the server
+
+    def setup(self):
+        self.request.do_handshake() # in the handler thread, not in accept
+        BaseHTTPRequestHandler.setup(self)
+
+    def log_message(self, *args):
+        pass
+
+    def _keys(self):
+        path = self.path.split('?')[0]
+        if path.endswith('.json'):
+            path = path[:-len('.json')]
+        return [unquote(key) for key in path.split('/') if key]
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def _reply(self, value):
+        latency, jitter = self.server.latency
+        time.sleep(latency + random.random() * jitter)
+        data = json.dumps(value).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._reply(self.server.store.get(self._keys()))
+
+    def do_PUT(self):
+        value = self._body()
+        self.server.store.set(self._keys(), value)
+        self._reply(value)
+
+    def do_POST(self):
+        self._reply({'name': self.server.store.push(self._keys(), self._body())})
+
+    def do_DELETE(self):
+        self.server.store.set(self._keys(), None)
+        self._reply(None)
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def get_request(self):
+        sock, address = self.socket.accept()
+        return self.context.wrap_socket(sock, server_side=True,
+                                        do_handshake_on_connect=False), address
+
+    def handle_error(self, request, client_address):
+        pass # clients hanging up on hedged or timed out requests
+
+def _certificate(directory):
+    """write a self signed certificate for localhost, return (cert, key) paths
+    """
+    import ipaddress
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    key = rsa.generate_private_key(65537, 2048, default_backend())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, u'localhost')])
+    now = datetime.datetime.utcnow()
+    cert = (x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(days=1))
+            .not_valid_after(now + datetime.timedelta(days=1))
+            .add_extension(x509.SubjectAlternativeName([
+                x509.DNSName(u'localhost'),
+                x509.IPAddress(ipaddress.ip_address(u'127.0.0.1'))]), critical=False)
+            .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+            .sign(key, hashes.SHA256(), default_backend()))
+    cert_path = os.path.join(directory, 'cert.pem')
+    key_path = os.path.join(directory, 'key.pem')
+    with open(cert_path, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM,
+                                  serialization.PrivateFormat.TraditionalOpenSSL,
+                                  serialization.NoEncryption()))
+    return cert_path, key_path
+
+def serve(cert_path, key_path, latency, jitter, ports):
+    """run the stand-in until the process is terminated, report port on ports
+    """
+    server = _Server(('127.0.0.1', 0), _Handler)
+    server.context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+    server.context.load_cert_chain(cert_path, key_path)
+    server.store = _Store()
+    server.latency = (latency, jitter)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+# ---- Workers ----
+class TimedSession(Session):
+    """session recording sql commit latency, with injected latency
+    """
+    histogram = None
+    latency = 0
+
+    def commit(self):
+        start = time.time()
+        if self.latency:
+            time.sleep(self.latency)
+        super(TimedSession, self).commit()
+        record(self.histogram, time.time() - start)
+
+class TimedAdaptor(Adaptor):
+    """adaptor recording latency of firebase calls
+    """
+    histogram = None
+
+    def _call(self, method, priority, url, *args, **kwargs):
+        start = time.time()
+        try:
+            return super(TimedAdaptor, self)._call(method, priority, url, *args, **kwargs)
+        finally:
+            record(self.histogram, time.time() - start)
+
+def _adaptor(session, config, histogram):
+    scheduler = Scheduler(rate=config['rate'], window=config['window'])
+    hedger = Hedger(methods=config['hedge']) if config['hedge'] else None
+    adaptor = TimedAdaptor(session, config['fire_url'], scheduler=scheduler,
+                           deadline=config['deadline'], hedger=hedger)
+    adaptor.histogram = histogram
+    return adaptor
+
+def work(index, config, ready, start, results):
+    """one worker process: set up, wait for start, replay the mix, report
+    """
+    rand = random.Random(config['seed'] + index)
+    hists = dict((name, {}) for name in OPERATIONS + PHASES)
+    errors = dict((name, 0) for name in OPERATIONS)
+    engine = create_engine(config['db_url'])
+    session = sessionmaker(bind=engine, class_=TimedSession)()
+    session.histogram = hists['sql']
+    session.latency = config['sql_latency']
+    adaptor = _adaptor(session, config, hists['http'])
+    chat_manager = ModelManager(adaptor, Chat, firepath=FIREPATH)
+    sync_manager = SyncManager(adaptor, Chat, firepath=FIREPATH)
+    chats = [chat_manager.add(name='seed {} {}'.format(index, i))
+             for i in range(config['seed_chats'])]
+    for name in hists:
+        hists[name].clear()
+    names, weights = zip(*config['mix'])
+    total = float(sum(weights))
+
+    def pick():
+        point = rand.random() * total
+        for name, weight in config['mix']:
+            point -= weight
+            if point < 0:
+                return name
+        return names[-1]
+
+    ready.put(index)
+    start.wait()
+    begin = time.time()
+    stop = begin + config['duration']
+    count = 0
+    while time.time() < stop:
+        name = pick()
+        if not chats and name != 'add':
+            name = 'add'
+        op_start = time.time()
+        try:
+            if name == 'add':
+                chats.append(chat_manager.add(name='chat {} {}'.format(index, count)))
+            elif name == 'push':
+                chat_manager.push(rand.choice(chats), {'msg': 'hi', 'n': count})
+            elif name == 'set':
+                sync_manager.set(rand.choice(chats), {'state': count})
+            elif name == 'get':
+                chat_manager.get(rand.choice(chats))
+            else:
+                chat_manager.delete(chats.pop(rand.randrange(len(chats))))
+        except Exception:
+            errors[name] += 1
+            session.rollback()
+        else:
+            record(hists[name], time.time() - op_start)
+        count += 1
+    results.put({'hists': hists, 'errors': errors, 'elapsed': time.time() - begin})
+
+def _collect(queue, processes, timeout):
+    """one item per worker from queue, raise if a worker dies or
+    the items do not arrive within timeout seconds
+    """
+    items = []
+    stop = time.time() + timeout
+    while len(items) < len(processes):
+        try:
+            items.append(queue.get(timeout=0.5))
+            continue
+        except Empty:
+            pass
+        dead = [process for process in processes if process.exitcode not in (None, 0)]
+        if dead:
+            raise Exception('Worker exited with code {}'.format(dead[0].exitcode))
+        if time.time() > stop:
+            raise Exception('Workers did not answer within {}s'.format(timeout))
+    return items
+
+def run(workers, config):
+    """run one round with workers processes, return merged results
+    """
+    ready = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    start = multiprocessing.Event()
+    processes = [multiprocessing.Process(target=work,
+                                         args=(index, config, ready, start, results))
+                 for index in range(workers)]
+    try:
+        for process in processes:
+            process.start()
+        _collect(ready, processes, GRACE)
+        start.set()
+        collected = _collect(results, processes, config['duration'] + GRACE)
+    except BaseException:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        raise
+    merged = {'hists': dict((name, {}) for name in OPERATIONS + PHASES),
+              'errors': dict((name, 0) for name in OPERATIONS),
+              'throughput': 0.0}
+    for result in collected:
+        for name, histogram in result['hists'].items():
+            merge(merged['hists'][name], histogram)
+        for name, count in result['errors'].items():
+            merged['errors'][name] += count
+        merged['throughput'] += sum(sum(h.values()) for name, h in result['hists'].items()
+                                    if name in OPERATIONS) / result['elapsed']
+    for process in processes:
+        process.join()
+    return merged
+
+def report(workers, merged, duration):
+    print('\n== {} worker(s): {:.1f} ops/s, {} errors =='.format(
+        workers, merged['throughput'], sum(merged['errors'].values())))
+    print('{:<8}{:>8}{:>10}{:>10}{:>10}{:>10}{:>8}'.format(
+        '', 'count', 'ops/s', 'p50 ms', 'p90 ms', 'p99 ms', 'errors'))
+    for name in OPERATIONS + PHASES:
+        histogram = merged['hists'][name]
+        count = sum(histogram.values())
+        print('{:<8}{:>8}{:>10.1f}{:>10.2f}{:>10.2f}{:>10.2f}{:>8}'.format(
+            name, count, count / float(duration),
+            percentile(histogram, 50), percentile(histogram, 90), percentile(histogram, 99),
+            merged['errors'].get(name, '')))
+
+def _mix(value):
+    mix = []
+    for item in value.split(','):
+        name, weight = item.split(':')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError('unknown operation: ' + name)
+        mix.append((name, float(weight)))
+    return mix
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='load test firebase-alchemy managers')
+    parser.add_argument('--workers', default='1,2,4', help='worker counts to sweep, e.g. 1,2,4,8')
+    parser.add_argument('--duration', type=float, default=5, help='seconds per round')
+    parser.add_argument('--mix', type=_mix, default=_mix('add:1,push:4,set:2,get:4,delete:1'),
+                        help='operation weights')
+    parser.add_argument('--latency', type=float, default=10, help='firebase latency in ms')
+    parser.add_argument('--jitter', type=float, default=10, help='extra random firebase latency in ms')
+    parser.add_argument('--sql-latency', type=float, default=0, help='latency added to sql commits in ms')
+    parser.add_argument('--db-url', help='sqlalchemy url, default a sqlite file in a temp directory')
+    parser.add_argument('--seed-chats', type=int, default=20, help='chats each worker adds before timing')
+    parser.add_argument('--rate', type=float, help='scheduler rate per worker, ops/s')
+    parser.add_argument('--window', type=int, help='scheduler in-flight window per worker')
+    parser.add_argument('--deadline', type=float, help='firebase deadline in seconds')
+    parser.add_argument('--hedge', action='store_true', help='hedge get requests')
+    parser.add_argument('--hedge-put', action='store_true', help='hedge put requests too')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='firebase-alchemy-load-')
+    server = None
+    try:
+        cert_path, key_path = _certificate(directory)
+        os.environ['REQUESTS_CA_BUNDLE'] = cert_path # workers trust the stand-in
+        ports = multiprocessing.Queue()
+        server = multiprocessing.Process(target=serve,
+                                         args=(cert_path, key_path, args.latency / 1000.0,
+                                               args.jitter / 1000.0, ports))
+        server.daemon = True
+        server.start()
+        db_url = args.db_url or 'sqlite:///' + os.path.join(directory, 'load.db')
+        engine = create_engine(db_url)
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        engine.dispose()
+        config = {
+            'fire_url': 'https://localhost:{}/'.format(ports.get(timeout=30)),
+            'db_url': db_url,
+            'duration': args.duration,
+            'mix': args.mix,
+            'sql_latency': args.sql_latency / 1000.0,
+            'seed_chats': args.seed_chats,
+            'rate': args.rate,
+            'window': args.window,
+            'deadline': args.deadline,
+            'hedge': ('get', 'put') if args.hedge_put else ('get',) if args.hedge else (),
+            'seed': args.seed
+        }
+        print('firebase stand-in {}, sql {}'.format(config['fire_url'], db_url))
+        for workers in [int(count) for count in args.workers.split(',')]:
+            report(workers, run(workers, config), args.duration)
+    finally:
+        if server is not None:
+            server.terminate()
+        # private key, certificate and the sqlite db
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,61 @@
+"""Micro benchmark of firebase path building.
+
+Lists get_path of many chats, as a server does when it sends a client the
+paths of all its topics, once with the previous per call string building
+and once with the compiled FirePath of the manager.
+
+    python benchmarks/paths.py [number of chats]
+"""
+import sys
+import timeit
+
+from firebase_alchemy.manager import Adaptor, ModelManager
+
+FIRE_URL = 'https://casual-local.firebaseio.com/'
+
+def _append_paths(base, extra):
+    """path building before FirePath, kept for comparison
+    """
+    if base[-1:] == '/':
+        base = base[:-1]
+    if extra[0] == '/':
+        extra = extra[1:]
+    if extra[-1:] == '/':
+        extra = extra[:-1]
+    return base + '/' + extra
+
+class LegacyManager(ModelManager):
+    """ModelManager with the previous _path
+    """
+    def _path(self, model_instance, full=False):
+        firepath = self.firepath
+        if full:
+            firepath = _append_paths(self.adaptor.url, firepath)
+        return _append_paths(firepath, model_instance.fireid)
+
+class Chat(object):
+    __firepath__ = 'chat'
+
+    def __init__(self, fireid):
+        self.fireid = fireid
+
+def main(count=10000, repeat=5):
+    adaptor = Adaptor(None, FIRE_URL)
+    manager = ModelManager(adaptor, Chat, firepath=['users', 'chats'])
+    legacy = LegacyManager(adaptor, Chat, firepath=['users', 'chats'])
+    chats = [Chat('-K{:019d}'.format(i)) for i in range(count)]
+    assert ([legacy.get_path(chat) for chat in chats] ==
+            [manager.get_path(chat) for chat in chats])
+    cases = [
+        ('legacy full', lambda: [legacy.get_path(chat) for chat in chats]),
+        ('FirePath full', lambda: [manager.get_path(chat) for chat in chats]),
+        ('legacy relative', lambda: [legacy.get_path(chat, full=False) for chat in chats]),
+        ('FirePath relative', lambda: [manager.get_path(chat, full=False) for chat in chats]),
+    ]
+    print('{} chats, best of {}'.format(count, repeat))
+    for name, case in cases:
+        best = min(timeit.repeat(case, number=1, repeat=repeat))
+        print('{:<20}{:>10.1f} ms{:>10.0f} ns/path'.format(name, best * 1000, best * 1e9 / count))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
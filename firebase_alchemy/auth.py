@@ -0,0 +1,226 @@
+"""Custom token minting for client access
+
+Used by workflow 2: the server hands the client a firebase path together with
+a signed custom token whose claims list the paths the client may access.
+Tokens are RS256 signed with a service account key, locally, so minting
+never talks to google services.
+"""
+import json
+import time
+import atexit
+import base64
+import threading
+from multiprocessing import Pool
+
+from exceptions import ValidationError
+
+__all__ = [
+    'TokenService'
+]
+
+AUDIENCE = 'https://identitytoolkit.googleapis.com/google.identity.identitytoolkit.v1.IdentityToolkit'
+MAX_LIFETIME = 3600 # firebase rejects custom tokens living longer than one hour
+RESERVED_CLAIMS = frozenset(['acr', 'amr', 'at_hash', 'aud', 'auth_time', 'azp',
+                             'cnf', 'c_hash', 'exp', 'firebase', 'iat', 'iss',
+                             'jti', 'nbf', 'nonce', 'sub'])
+
+def _b64(raw):
+    """url safe base64 without padding, as jwt requires
+    """
+    return base64.urlsafe_b64encode(raw).rstrip(b'=')
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+def _load_key(private_key):
+    """load a PEM private key (PKCS1 or PKCS8, as in service account json)
+    """
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    if not isinstance(private_key, bytes):
+        private_key = private_key.encode('utf-8')
+    return serialization.load_pem_private_key(private_key,
+                                              password=None,
+                                              backend=default_backend())
+
+def _sign(key, service_email, uid, claims, iat, exp):
+    """build and sign one custom token
+    """
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+    payload = {
+        'iss': service_email,
+        'sub': service_email,
+        'aud': AUDIENCE,
+        'iat': iat,
+        'exp': exp,
+        'uid': uid
+    }
+    if claims:
+        payload['claims'] = claims
+    segments = [_b64(_dumps({'alg': 'RS256', 'typ': 'JWT'})),
+                _b64(_dumps(payload))]
+    signature = key.sign(b'.'.join(segments), padding.PKCS1v15(), hashes.SHA256())
+    return b'.'.join(segments + [_b64(signature)])
+
+def _path_claims(paths):
+    """turn a list of firebase paths into a nested claim map.
+
+    ['chats/-Kabc', 'chats/-Kdef'] -> {'chats': {'-Kabc': True, '-Kdef': True}}
+    so security rules can check `auth.token.paths.chats[$chat] === true`
+    """
+    tree = {}
+    for path in paths:
+        keys = [key for key in path.split('/') if key]
+        if not keys:
+            raise ValidationError('Can not grant access to root path')
+        node = tree
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+            if node is True: # a parent path is already granted
+                break
+        else:
+            node[keys[-1]] = True
+    return tree
+
+# -- process pool workers, key is loaded once per worker process --
+_worker = {}
+
+def _pool_init(service_email, private_key):
+    _worker['email'] = service_email
+    _worker['key'] = _load_key(private_key)
+
+def _pool_sign(args):
+    uid, claims, iat, exp = args
+    return _sign(_worker['key'], _worker['email'], uid, claims, iat, exp)
+
+class TokenService(object):
+    """Mint and cache firebase custom tokens for one service account
+    """
+    def __init__(self, service_email, private_key, lifetime=MAX_LIFETIME,
+                 margin=300, processes=None, max_size=10000, clock=time.time):
+        """Init token service
+
+        Args:
+            service_email(string): client_email of the service account
+            private_key(string): PEM private key of the service account
+            lifetime(int): seconds a minted token stays valid
+            margin(int): seconds before expiry a cached token is re-minted
+            processes(int): worker processes used by mint_many, None to sign inline
+            max_size(int): cached tokens kept before expired ones are dropped
+            clock(callable): returns current unix time
+        """
+        if not 0 < lifetime <= MAX_LIFETIME:
+            raise Exception('Config: token lifetime has to be within (0, {}]'.format(MAX_LIFETIME))
+        if not 0 <= margin < lifetime:
+            raise Exception('Config: token margin has to be within [0, lifetime)')
+        self.service_email = service_email
+        self.lifetime = lifetime
+        self.margin = margin
+        self.processes = processes
+        self.max_size = max_size
+        self.clock = clock
+        self._private_key = private_key
+        self._key = _load_key(private_key)
+        self._pool = None
+        self._cache = {} # key: (uid, claims json), value: (token, exp)
+        self._lock = threading.Lock()
+
+    def _claims(self, paths, claims):
+        """merge granted paths into developer claims
+        """
+        claims = dict(claims or {})
+        reserved = RESERVED_CLAIMS.intersection(claims)
+        if reserved:
+            raise ValidationError('Reserved claims: {}'.format(sorted(reserved)))
+        if 'paths' in claims:
+            raise ValidationError('Claim "paths" is generated from granted paths')
+        if paths:
+            claims['paths'] = _path_claims(paths)
+        return claims
+
+    def _lookup(self, cache_key, now):
+        entry = self._cache.get(cache_key)
+        if entry and now < entry[1] - self.margin:
+            return entry[0]
+        return None
+
+    def _store(self, cache_key, token, exp, now):
+        with self._lock:
+            if len(self._cache) >= self.max_size:
+                for key, entry in list(self._cache.items()):
+                    if now >= entry[1] - self.margin:
+                        del self._cache[key]
+                if len(self._cache) >= self.max_size:
+                    self._cache.clear()
+            self._cache[cache_key] = (token, exp)
+
+    def mint(self, uid, paths=None, claims=None):
+        """return a custom token for uid, reuse a cached one if it is still fresh
+
+        Args:
+            uid(string): firebase uid of the client
+            paths(list): firebase paths the client is allowed to access
+            claims(dict): additional developer claims
+        """
+        return self.mint_many([(uid, paths, claims)])[0]
+
+    def mint_many(self, grants):
+        """mint tokens for a batch of (uid, paths[, claims]) grants
+
+        Cache misses are signed across the process pool if `processes` is set.
+        Signing happens outside the cache lock, so concurrent calls missing
+        on the same (uid, claims) each sign a token, and the last one is cached.
+        Return: tokens in the same order as grants.
+        """
+        now = int(self.clock())
+        tokens = [None] * len(grants)
+        pending = {} # key: cache key, value: indexes waiting for it
+        jobs = []
+        for index, grant in enumerate(grants):
+            uid, paths = grant[0], grant[1]
+            claims = self._claims(paths, grant[2] if len(grant) > 2 else None)
+            cache_key = (uid, json.dumps(claims, sort_keys=True))
+            token = self._lookup(cache_key, now)
+            if token:
+                tokens[index] = token
+            elif cache_key in pending:
+                pending[cache_key].append(index)
+            else:
+                pending[cache_key] = [index]
+                jobs.append((cache_key, (uid, claims, now, now + self.lifetime)))
+        if not jobs:
+            return tokens
+        if self.processes and len(jobs) > 1:
+            signed = self._get_pool().map(_pool_sign, [args for _, args in jobs])
+        else:
+            signed = [_sign(self._key, self.service_email, *args) for _, args in jobs]
+        for (cache_key, args), token in zip(jobs, signed):
+            self._store(cache_key, token, args[3], now)
+            for index in pending[cache_key]:
+                tokens[index] = token
+        return tokens
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = Pool(self.processes,
+                                  initializer=_pool_init,
+                                  initargs=(self.service_email, self._private_key))
+                atexit.register(self.close) # do not leave workers behind
+            return self._pool
+
+    def close(self):
+        """shut down signing processes, also done at interpreter exit
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
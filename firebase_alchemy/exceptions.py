@@ -7,3 +7,8 @@ class ValidationError(Exception):
     """Raise when validator find err
     """
     pass
+
+class DeadlineError(Exception):
+    """Raise when a firebase operation misses its deadline
+    """
+    pass
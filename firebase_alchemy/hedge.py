@@ -0,0 +1,267 @@
+"""Deadline bounded and hedged firebase requests
+
+A hedged request sends a duplicate of a slow request once it has been
+outstanding longer than a recent latency percentile, and uses whichever
+answers first. Only safe for requests that can be repeated, reads and PUTs
+to a known key; POSTs create a new key each time and are never hedged.
+
+The attempt which loses is not cancelled. For a PUT it may land after a
+newer write to the same key and overwrite it, so PUTs are only hedged if
+asked for.
+"""
+import os
+import time
+import threading
+from collections import deque
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from exceptions import DeadlineError
+from timer import schedule
+
+__all__ = [
+    'Hedger',
+    'connection'
+]
+
+HEDGEABLE = ('get', 'put') # firebase methods which may be sent twice
+
+POOL_SIZE = 32 # keep-alive connections per host in the shared session
+
+class _Connection(object):
+    """One request on the shared session, with its own time limit.
+
+    python-firebase sets a 60 seconds timeout and headers on the connection
+    it is given, so they are kept here, per request, while the session and
+    its connection pool are shared by all threads.
+
+    The limit is the requests timeout: it bounds the connect and every read
+    of the response, not the total time of a response which keeps trickling
+    in. Only hedged requests are bounded in total, see Hedger.run.
+    """
+    def __init__(self, session, limit):
+        self.session = session
+        self.limit = limit
+        self.timeout = None
+        self.headers = {}
+
+    def request(self, method, url, **kwargs):
+        if self.limit is not None:
+            kwargs['timeout'] = self.limit
+        headers = dict(self.headers)
+        headers.update(kwargs.get('headers') or {})
+        kwargs['headers'] = headers
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+_shared = {} # key: 'session', 'pid'
+_shared_lock = threading.Lock()
+
+def _session():
+    """the session of this process, created again after a fork
+    """
+    with _shared_lock:
+        if _shared.get('pid') != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _shared['session'] = session
+            _shared['pid'] = os.getpid()
+        return _shared['session']
+
+def connection(deadline=None):
+    """return a connection for one request, bounded by deadline.
+
+    All connections share one session, so keep-alive sockets are reused
+    across calls and threads instead of opening a new one for every request.
+    """
+    limit = None
+    if deadline is not None:
+        limit = deadline - time.time()
+        if limit <= 0:
+            raise DeadlineError('Deadline passed before request was sent')
+    return _Connection(_session(), limit)
+
+class _Workers(object):
+    """Persistent daemon threads running attempts, started on demand,
+    so a hedged request does not pay for starting new threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def submit(self, job):
+        with self._lock:
+            if self._pid != os.getpid(): # threads do not survive a fork
+                self._pid = os.getpid()
+                self._jobs = Queue()
+                self._idle = 0
+            if self._idle:
+                self._idle -= 1
+            else:
+                thread = threading.Thread(target=self._loop, args=(self._jobs,))
+                thread.daemon = True
+                thread.start()
+            self._jobs.put(job)
+
+    def _loop(self, jobs):
+        while True:
+            jobs.get()()
+            with self._lock:
+                self._idle += 1
+
+_workers = _Workers()
+
+def _admit(block):
+    return True
+
+def _ignore(error=None):
+    pass
+
+class Hedger(object):
+    """Send a duplicate of slow requests, tracks latency per method
+    """
+    def __init__(self, percentile=95, delay=0.05, samples=256, min_samples=20,
+                 max_ratio=0.1, methods=('get',)):
+        """Init hedger
+
+        Args:
+            percentile(float): latency percentile after which a request is hedged
+            delay(float): hedge delay in seconds until min_samples are recorded
+            samples(int): latencies kept per method
+            max_ratio(float): max fraction of requests that may be hedged
+            methods(tuple): firebase methods to hedge, add 'put' only if a late
+                duplicate overwriting a newer write to the same key is fine
+        """
+        unknown = set(methods) - set(HEDGEABLE)
+        if unknown:
+            raise Exception('Config: methods {} can not be hedged'.format(sorted(unknown)))
+        self.methods = tuple(methods)
+        self.percentile = percentile
+        self.initial_delay = delay
+        self.samples = samples
+        self.min_samples = min_samples
+        self.max_ratio = max_ratio
+        self.stats = {'requests': 0, 'hedged': 0, 'hedge_wins': 0,
+                      'skipped': 0, 'timeouts': 0}
+        self._latencies = {} # key: method, value: recent latencies
+        self._lock = threading.Lock()
+
+    @property
+    def hedge_rate(self):
+        """fraction of requests that were hedged
+        """
+        return float(self.stats['hedged']) / max(1, self.stats['requests'])
+
+    @property
+    def win_rate(self):
+        """fraction of hedges that answered first
+        """
+        return float(self.stats['hedge_wins']) / max(1, self.stats['hedged'])
+
+    def delay(self, method):
+        """seconds to wait before hedging a request of method
+        """
+        latencies = self._latencies.get(method)
+        if not latencies or len(latencies) < self.min_samples:
+            return self.initial_delay
+        latencies = sorted(latencies)
+        index = int(len(latencies) * self.percentile / 100.0)
+        return latencies[min(index, len(latencies) - 1)]
+
+    def _record(self, method, latency):
+        with self._lock:
+            if method not in self._latencies:
+                self._latencies[method] = deque(maxlen=self.samples)
+            self._latencies[method].append(latency)
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _start(self, method, attempt, results, hedge, release):
+        def job():
+            start = time.time()
+            try:
+                result = attempt()
+            except Exception as e:
+                release(e)
+                results.put(('result', hedge, False, e))
+            else:
+                self._record(method, time.time() - start)
+                release()
+                results.put(('result', hedge, True, result))
+        _workers.submit(job)
+
+    def run(self, method, attempt, deadline=None, admit=None, release=None):
+        """run attempt(), and a second one if the first is slow.
+
+        Both attempts run on worker threads, so the call returns at the
+        deadline even if firebase is still sending the response. The hedge
+        and the deadline are delivered as events by the timer thread.
+
+        Args:
+            method(string): request kind, latencies are tracked per method
+            attempt(callable): sends the request, safe to call twice at once
+            deadline(float): optional, time by which an answer is required
+            admit(callable): optional, admit(block) takes a scheduler slot for
+                an attempt. Blocks for the first one, for the hedge it returns
+                False if no slot is free now, and the hedge is skipped.
+            release(callable): optional, release(error) gives the slot back
+                once its attempt finished, also after run returned
+
+        Return: result of the attempt which succeeds first.
+        """
+        admit = admit or _admit
+        release = release or _ignore
+        admit(True)
+        self._count('requests')
+        results = Queue()
+        self._start(method, attempt, results, False, release)
+        launched = 1
+        errors = []
+        schedule(time.time() + self.delay(method), results.put, ('hedge',))
+        if deadline is not None:
+            schedule(deadline, results.put, ('deadline',))
+        while True:
+            event = results.get()
+            if event[0] == 'hedge':
+                if self.hedge_rate < self.max_ratio:
+                    if admit(False):
+                        self._count('hedged')
+                        self._start(method, attempt, results, True, release)
+                        launched += 1
+                    else:
+                        self._count('skipped')
+                continue
+            if event[0] == 'deadline':
+                self._count('timeouts')
+                raise DeadlineError('Deadline passed waiting for {} response'.format(method))
+            hedge, ok, value = event[1:]
+            if ok:
+                if hedge:
+                    self._count('hedge_wins')
+                return value
+            errors.append(value)
+            if len(errors) == launched:
+                raise errors[0]
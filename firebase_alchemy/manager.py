@@ -1,5 +1,10 @@
+import time
 from firebase.firebase import FirebaseApplication
-from exceptions import SQLError, ValidationError
+from requests.exceptions import Timeout
+from exceptions import SQLError, ValidationError, DeadlineError
+from scheduler import Scheduler, INTERACTIVE, DEFAULT
+from hedge import connection
+from path import FirePath, validate_key
 
 __all__ = [
     'Adaptor',
@@ -10,21 +15,67 @@ __all__ = [
 class Adaptor(object):
     """Manager for one db instance
     """
-    def __init__(self, session, fire_url):
+    def __init__(self, session, fire_url, tokens=None, scheduler=None,
+                 deadline=None, hedger=None):
         """Init adaptor
 
         Args:
             session(sqlalchemy session): db operation session
             fire(firebase class): fire operation reference
+            tokens(TokenService): optional, mints client tokens for get_token
+            scheduler(Scheduler): optional, limits and orders firebase operations
+            deadline(float or dict): optional, seconds a firebase operation may
+                take, or a dict. key: method (get, put, post, delete), value: seconds.
+                Bounds the wait in the scheduler and each connect and read of
+                the request; hedged requests are also bounded in total
+            hedger(Hedger): optional, hedges slow requests of hedger.methods
         """
         self.session = session
         self.fire = FirebaseApplication(fire_url)
         self.url = fire_url
+        self.tokens = tokens
+        self.scheduler = scheduler or Scheduler()
+        self.deadline = deadline
+        self.hedger = hedger
         self.maps = {} # key: table name, value: firepath
 
     def _map(self, table_name, firepath):
         self.maps[table_name] = firepath
 
+    def _deadline(self, method):
+        """absolute deadline for an operation of method, None if unbounded
+        """
+        timeout = self.deadline
+        if isinstance(timeout, dict):
+            timeout = timeout.get(method)
+        if timeout is None:
+            return None
+        return time.time() + timeout
+
+    def _call(self, method, priority, url, *args, **kwargs):
+        """run one firebase operation through the scheduler, bounded by its
+        deadline, and hedged if the hedger is set up for the method
+        """
+        deadline = self._deadline(method)
+        def attempt():
+            try:
+                return getattr(self.fire, method)(url, *args,
+                                                  connection=connection(deadline),
+                                                  **kwargs)
+            except Timeout:
+                if deadline is None: # python-firebase's own timeout
+                    raise
+                raise DeadlineError('Deadline passed waiting for {} response'.format(method))
+        scheduler = self.scheduler
+        if self.hedger and method in self.hedger.methods:
+            # every attempt holds its own scheduler slot until it finishes
+            def admit(block):
+                return scheduler.acquire(url, priority, deadline, block=block)
+            return scheduler.retry(lambda: self.hedger.run(method, attempt, deadline,
+                                                           admit, scheduler.release))
+        return scheduler.run(url, priority, attempt, deadline,
+                             idempotent=method != 'post')
+
     def _write(self, fireid, model_cls, **model_args):
         """add a db entry, and return the new model instance
         """
@@ -34,46 +85,34 @@ class Adaptor(object):
         self.session.commit()
         return new_model
 
-def _append_paths(base, extra):
-    """Give a base path and a string, expand the path.
-    """
-    if base[-1:] == '/':
-        base = base[:-1]
-    if extra[0] == '/':
-        extra = extra[1:]
-    if extra[-1:] == '/':
-        extra = extra[:-1]
-    return base + '/' + extra
-
 class AbstractManager(object):
     """General manager
     """
-    def __init__(self, adaptor, model_cls, firepath=None, validator=None):
+    def __init__(self, adaptor, model_cls, firepath=None, validator=None,
+                 priority=None):
         """Init
 
         Args:
             model(a sqlalchemy model with mixin): model class
             firepath(a string or list): the location should be insert for firebase
+            priority(int): optional, scheduler priority for all operations of
+                this manager, e.g. scheduler.BACKGROUND for reconciliation jobs
         """
         self.adaptor = adaptor
         self.model_cls = model_cls
         self.validator = validator
+        self.priority = priority
         if validator:
             if (not isinstance(validator, dict)) and (not isinstance(validator, list)):
                 raise Exception('validator has to be dict or list')
-        if firepath:
-            if isinstance(firepath, list): # allow list
-                # put in a string
-                self.firepath = ''
-                for path in firepath:
-                    self.firepath = _append_paths(self.firepath, path)
-            else:
-                self.firepath = firepath
-        else: # no firepath
+        if not firepath:
             # user default from mixin
             if not model_cls.__firepath__:
                 raise Exception('Config: No firepath available')
-            self.firepath = model_cls.__firepath__
+            firepath = model_cls.__firepath__
+        # compile once, list allowed
+        self.path = FirePath(firepath, base=self.adaptor.url)
+        self.firepath = self.path.path
         # record mapping
         self.adaptor._map(self.model_cls.__name__.lower(),
                           self.firepath)
@@ -81,10 +120,16 @@ class AbstractManager(object):
     def _path(self, model_instance, full=False):
         """give a model instance, retrive the firepath of it
         """
-        firepath = self.firepath
         if full:
-            firepath  = _append_paths(self.adaptor.url, firepath)
-        return _append_paths(firepath, model_instance.fireid)
+            return self.path.full(model_instance.fireid)
+        return self.path.child(model_instance.fireid)
+
+    def _priority(self, default):
+        """scheduler priority of an operation, manager setting wins
+        """
+        if self.priority is None:
+            return default
+        return self.priority
 
     def _validate(self, payload, key=None):
         """helper function, gives a payload and validate the format
@@ -125,15 +170,16 @@ class AbstractManager(object):
         """
         if init_payload is not True: # need validation
             self._validate(init_payload)
-        fireid = self.adaptor.fire.post(url=self.firepath,
-                                         data=init_payload)['name']
+        priority = self._priority(DEFAULT)
+        fireid = self.adaptor._call('post', priority, self.firepath,
+                                    data=init_payload)['name']
         try:
             new_instance = self.adaptor._write(fireid=fireid,
                                                model_cls=self.model_cls,
                                                **model_args)
         except Exception, e: # fail to write to sql
             # remove firebase record
-            self.adaptor.fire.delete(self.firepath, fireid)
+            self.adaptor._call('delete', priority, self.firepath, fireid)
             raise SQLError('Failure writing to SQL: '+ str(e))
         return new_instance
 
@@ -141,15 +187,38 @@ class AbstractManager(object):
     def delete(self, model_instance):
         """propagate delete in firebase first, then delete a model instance.
         """
-        self.adaptor.fire.delete(self.firepath, model_instance.fireid)
+        self.adaptor._call('delete', self._priority(DEFAULT),
+                           self.firepath, model_instance.fireid)
         self.adaptor.session.delete(model_instance)
         self.adaptor.session.commit()
 
     def get(self, model_instance, subpath=None):
         """get data for a model instance. 
+
+        Optional: subpath, e.g. 'messages/-Kabc', every key of it is validated
+        """
+        if subpath:
+            keys = [key for key in subpath.split('/') if key]
+            url = self.path.subpath(model_instance.fireid, *keys)
+        else:
+            url = self._path(model_instance)
+        return self.adaptor._call('get', self._priority(INTERACTIVE), url, None)
+
+    def get_token(self, uid, model_instances, claims=None):
+        """return a custom token granting uid access to the firebase
+        locations of model_instances, normally send to web client with get_path.
+
+        Args:
+            uid(string): firebase uid of the client
+            model_instances(model instance or a list): instances to grant access
+            claims(dict): optional, additional claims
         """
-        return self.adaptor.fire.get(self._path(model_instance),
-                                     subpath)
+        if not self.adaptor.tokens:
+            raise Exception('Config: No token service available')
+        if not isinstance(model_instances, list):
+            model_instances = [model_instances]
+        paths = [self._path(instance) for instance in model_instances]
+        return self.adaptor.tokens.mint(uid, paths=paths, claims=claims)
 
 class SyncManager(AbstractManager):
     """Sync manager use to build and maintain one to one relationship
@@ -170,15 +239,18 @@ class SyncManager(AbstractManager):
         """
         # extract fire id and set data
         if entry:
+            validate_key(entry)
             self._validate(payload=data, key=entry)
-            self.adaptor.fire.put(url=self._path(model_instance),
-                                  name=entry,
-                                  data=data)
+            self.adaptor._call('put', self._priority(INTERACTIVE),
+                               self._path(model_instance),
+                               name=entry,
+                               data=data)
         else:
             self._validate(payload=data)
-            self.adaptor.fire.put(url=self.firepath,
-                                  name=model_instance.fireid,
-                                  data=data)
+            self.adaptor._call('put', self._priority(INTERACTIVE),
+                               self.firepath,
+                               name=model_instance.fireid,
+                               data=data)
 
 class ModelManager(AbstractManager):
     """ModelManager use to build and maintain one to multiple relationship
@@ -204,8 +276,8 @@ class ModelManager(AbstractManager):
         """
         # validate the payload
         self._validate(payload)
-        self.adaptor.fire.post(self._path(model_instance),
-                               payload)
+        self.adaptor._call('post', self._priority(INTERACTIVE),
+                           self._path(model_instance), payload)
 
     def get_path(self, model_instance, full=True):
         """return the path to firebase instance,
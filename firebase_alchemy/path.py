@@ -0,0 +1,107 @@
+"""Compiled firebase paths
+
+A FirePath normalizes and validates a manager location once, so building
+the path of a model instance is a single string concatenation.
+"""
+import re
+
+from exceptions import ValidationError
+
+__all__ = [
+    'FirePath',
+    'validate_key'
+]
+
+# firebase keys can not contain . $ # [ ] / or ascii control characters
+FORBIDDEN = re.compile(u'[.$#\\[\\]/\x00-\x1f\x7f]')
+MAX_KEY_BYTES = 768
+
+def validate_key(key):
+    """raise ValidationError if key can not be used as a firebase key
+    """
+    if not key or FORBIDDEN.search(key):
+        raise ValidationError('Invalid firebase key: {!r}'.format(key))
+    if not isinstance(key, bytes):
+        size = len(key.encode('utf-8'))
+    else:
+        size = len(key)
+    if size > MAX_KEY_BYTES:
+        raise ValidationError('Firebase key longer than {} bytes'.format(MAX_KEY_BYTES))
+    return key
+
+def _split(path):
+    """split a path string, or a list of them, into validated keys
+    """
+    if not isinstance(path, (list, tuple)):
+        path = [path]
+    return tuple(validate_key(key)
+                 for part in path
+                 for key in part.split('/') if key)
+
+class FirePath(object):
+    """Immutable, validated location of a manager in firebase
+    """
+    __slots__ = ('segments', 'base', 'path', 'url', '_prefix', '_url_prefix')
+
+    def __init__(self, path, base=''):
+        """Init
+
+        Args:
+            path(a string or list): location in firebase, e.g. 'chats' or ['users', 'chats']
+            base(string): firebase url, used for full urls
+        """
+        segments = _split(path)
+        if not segments:
+            raise ValidationError('Empty firebase path')
+        base = base[:-1] if base[-1:] == '/' else base
+        joined = '/'.join(segments)
+        set_slot = object.__setattr__
+        set_slot(self, 'segments', segments)
+        set_slot(self, 'base', base)
+        set_slot(self, 'path', joined)
+        set_slot(self, 'url', base + '/' + joined)
+        set_slot(self, '_prefix', joined + '/')
+        set_slot(self, '_url_prefix', base + '/' + joined + '/')
+
+    def __setattr__(self, name, value):
+        raise AttributeError('FirePath is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('FirePath is immutable')
+
+    def child(self, key):
+        """path of a direct child. key is not validated, use it for keys
+        generated by firebase, like fireid.
+        """
+        return self._prefix + key
+
+    def full(self, key):
+        """full url of a direct child, see child
+        """
+        return self._url_prefix + key
+
+    def subpath(self, *keys):
+        """path of a validated descendant, e.g. subpath(fireid, 'msg')
+        """
+        return self._prefix + '/'.join([validate_key(key) for key in keys])
+
+    def join(self, *keys):
+        """FirePath of a descendant
+        """
+        return FirePath(self.segments + keys, self.base)
+
+    def __str__(self):
+        return self.path
+
+    def __repr__(self):
+        return 'FirePath({!r}, base={!r})'.format(self.path, self.base)
+
+    def __eq__(self, other):
+        return (isinstance(other, FirePath) and
+                self.segments == other.segments and self.base == other.base)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.segments, self.base))
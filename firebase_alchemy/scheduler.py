@@ -0,0 +1,248 @@
+"""Client side scheduling of firebase operations
+
+Every firebase request from the managers goes through a Scheduler, which
+keeps the adaptor under firebase write throughput: token bucket limits for
+the whole database and per path prefix, priority classes so interactive
+calls go ahead of background work, a bounded in-flight window, and
+adaptive slowdown when firebase answers 429 or 503.
+"""
+import time
+import itertools
+import threading
+
+from exceptions import DeadlineError
+from timer import schedule
+
+__all__ = [
+    'Scheduler',
+    'INTERACTIVE',
+    'DEFAULT',
+    'BACKGROUND'
+]
+
+# priority classes, lower runs first
+INTERACTIVE = 0
+DEFAULT = 1
+BACKGROUND = 2
+
+THROTTLE_STATUS = (429, 503)
+
+def _status(error):
+    """http status of a requests error, None for anything else
+    """
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+def _retry_after(error):
+    """seconds firebase asked to wait, None if not given
+    """
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers['Retry-After'])
+    except Exception:
+        return None
+
+class _Bucket(object):
+    """Token bucket, refilled at rate * factor per second up to burst
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self.tokens = self.burst
+        self.stamp = None
+
+    def wait(self, now, factor):
+        """seconds until a token is available, 0 if one is available now
+        """
+        if self.stamp is not None:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.stamp) * self.rate * factor)
+        self.stamp = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / (self.rate * factor)
+
+    def take(self):
+        self.tokens -= 1
+
+class Scheduler(object):
+    """Rate limit, prioritize and back off firebase operations of one database
+    """
+    def __init__(self, rate=None, burst=None, prefixes=None, window=None,
+                 retries=2, backoff=0.5, recovery=0.05, min_factor=0.05,
+                 pause=0.5, max_pause=30, clock=time.time):
+        """Init scheduler, with no arguments operations pass straight through.
+
+        Args:
+            rate(float): operations per second for the whole database
+            burst(int): bucket size for rate, defaults to one second of rate
+            prefixes(dict): key: path prefix, value: rate or (rate, burst)
+            window(int): max operations in flight at once
+            retries(int): times a throttled operation is queued again
+            backoff(float): rate and window are multiplied by it on throttle
+            recovery(float): added back to the multiplier on every success
+            min_factor(float): floor of the multiplier
+            pause(float): seconds to hold all operations after a throttle,
+                doubles on consecutive throttles up to max_pause
+            clock(callable): returns current time in seconds
+        """
+        self.bucket = _Bucket(rate, burst) if rate else None
+        self.prefixes = []
+        for prefix, limit in (prefixes or {}).items():
+            if not isinstance(limit, (tuple, list)):
+                limit = (limit,)
+            self.prefixes.append((prefix.strip('/'), _Bucket(*limit)))
+        self.window = window
+        self.retries = retries
+        self.backoff = backoff
+        self.recovery = recovery
+        self.min_factor = min_factor
+        self.pause = pause
+        self.max_pause = max_pause
+        self.clock = clock
+        self.factor = 1.0 # adaptive multiplier for rates and window
+        self.in_flight = 0
+        self.stats = {'completed': 0, 'failed': 0, 'throttled': 0, 'retried': 0}
+        self._paused_until = 0
+        self._throttles = 0 # consecutive throttled responses
+        self._waiting = [] # tickets: (priority, seq, buckets)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _buckets(self, path):
+        """buckets an operation on path has to take a token from
+        """
+        path = (path or '').strip('/')
+        buckets = [bucket for prefix, bucket in self.prefixes
+                   if path == prefix or path.startswith(prefix + '/')]
+        if self.bucket:
+            buckets.append(self.bucket)
+        return buckets
+
+    def _wait_time(self, buckets, now):
+        """seconds until buckets could run, 0 if now, None if until a release
+        """
+        if self.window and self.in_flight >= max(1, int(self.window * self.factor)):
+            return None
+        if now < self._paused_until:
+            return self._paused_until - now
+        return max([bucket.wait(now, self.factor) for bucket in buckets] or [0])
+
+    def acquire(self, path, priority, deadline=None, block=True):
+        """take a slot, blocking until the operation is allowed to run,
+        or until deadline. Every acquire has to be followed by a release.
+
+        Optional: block, if False take a slot only if one is free now and no
+        waiting operation could take it, return False otherwise
+        """
+        buckets = self._buckets(path)
+        with self._cond:
+            if not block:
+                now = self.clock()
+                if (self._wait_time(buckets, now) != 0 or
+                        any(self._wait_time(other[2], now) == 0 for other in self._waiting)):
+                    return False
+                for bucket in buckets:
+                    bucket.take()
+                self.in_flight += 1
+                return True
+            ticket = (priority, next(self._seq), buckets)
+            self._waiting.append(ticket)
+            wake_at = None # pending wake-up of this ticket, in clock time
+            try:
+                while True:
+                    now = self.clock()
+                    wait = self._wait_time(buckets, now)
+                    if wait == 0:
+                        ahead = [other for other in self._waiting
+                                 if other[:2] < ticket[:2]
+                                 and self._wait_time(other[2], now) == 0]
+                        if not ahead:
+                            break
+                        wait = None # a higher priority operation goes first
+                    if deadline is not None:
+                        if now >= deadline:
+                            raise DeadlineError('Deadline passed waiting in scheduler')
+                        wait = deadline - now if wait is None else min(wait, deadline - now)
+                    if wait is not None and (wake_at is None or wake_at <= now
+                                             or now + wait < wake_at):
+                        wake_at = now + wait
+                        schedule(time.time() + wait, self._wake)
+                    # untimed, a timed wait on python 2 polls and wakes up late
+                    self._cond.wait()
+                for bucket in buckets:
+                    bucket.take()
+                self.in_flight += 1
+                return True
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+
+    def _wake(self):
+        """called by the timer when a waiting operation may be able to run
+        """
+        with self._cond:
+            self._cond.notify_all()
+
+    def release(self, error=None):
+        """give back the slot of a finished operation, adapt to how firebase
+        answered. error is the exception raised by the operation, if any.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if error is None:
+                self._throttles = 0
+                self.factor = min(1.0, self.factor + self.recovery)
+                self.stats['completed'] += 1
+            elif _status(error) in THROTTLE_STATUS:
+                self._throttles += 1
+                self.factor = max(self.min_factor, self.factor * self.backoff)
+                pause = _retry_after(error)
+                if pause is None:
+                    pause = self.pause * 2 ** (self._throttles - 1)
+                self._paused_until = self.clock() + min(pause, self.max_pause)
+                self.stats['throttled'] += 1
+            else:
+                self.stats['failed'] += 1
+            self._cond.notify_all()
+
+    def run(self, path, priority, operation, deadline=None, idempotent=True):
+        """run operation() once path and priority allow,
+        queue it again if firebase throttles it.
+
+        Optional: deadline, time by which the operation has to be started,
+        DeadlineError is raised otherwise
+
+        Optional: idempotent, False for operations which must not be sent
+        twice, like POST. Those are only queued again on 429, since a 503
+        from a proxy can come after the write was applied.
+
+        Return: result of operation.
+        """
+        def once():
+            self.acquire(path, priority, deadline)
+            try:
+                result = operation()
+            except Exception as e:
+                self.release(e)
+                raise
+            self.release()
+            return result
+        return self.retry(once, idempotent)
+
+    def retry(self, operation, idempotent=True):
+        """call operation() again while firebase throttles it, up to retries
+        times. operation acquires and releases its own slots.
+        """
+        attempt = 0
+        while True:
+            try:
+                return operation()
+            except Exception as e:
+                status = _status(e)
+                retry = status == 429 or (idempotent and status in THROTTLE_STATUS)
+                if not retry or attempt >= self.retries:
+                    raise
+                attempt += 1
+                with self._cond:
+                    self.stats['retried'] += 1
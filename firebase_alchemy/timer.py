@@ -0,0 +1,66 @@
+"""Precise wake-ups for threads waiting on a time
+
+On python 2 a timed wait on a lock, condition or queue polls with sleeps of
+up to 50ms, which delays whoever is woken up by something else than the
+timeout. Threads here wait without a timeout instead, and a single timer
+thread calls them back when their time has come.
+"""
+import os
+import time
+import heapq
+import select
+import itertools
+import threading
+
+__all__ = [
+    'schedule'
+]
+
+class _Timer(object):
+    """One thread calling functions at given times.
+
+    It waits with select on a pipe, which wakes up on time, and is woken up
+    early through the pipe when an earlier entry is scheduled.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def schedule(self, when, function, *args):
+        with self._lock:
+            if self._pid != os.getpid(): # threads do not survive a fork
+                self._pid = os.getpid()
+                self._heap = []
+                self._seq = itertools.count()
+                self._read, self._write = os.pipe()
+                thread = threading.Thread(target=self._loop, args=(self._heap, self._read))
+                thread.daemon = True
+                thread.start()
+            entry = (when, next(self._seq), function, args)
+            heapq.heappush(self._heap, entry)
+            wake = self._heap[0] is entry
+            write = self._write
+        if wake: # new earliest time
+            os.write(write, b'x')
+
+    def _loop(self, heap, read):
+        while True:
+            due = []
+            with self._lock:
+                now = time.time()
+                while heap and heap[0][0] <= now:
+                    due.append(heapq.heappop(heap)[2:])
+                timeout = heap[0][0] - now if heap else None
+            if due: # called without the lock, they may schedule again
+                for function, args in due:
+                    function(*args)
+                continue
+            if select.select([read], [], [], timeout)[0]:
+                os.read(read, 4096)
+
+_timer = _Timer()
+
+def schedule(when, function, *args):
+    """call function(*args) on the timer thread at unix time when
+    """
+    _timer.schedule(when, function, *args)
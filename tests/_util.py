@@ -1,3 +1,54 @@
+import time
+import threading
+
+class Fire(object):
+    """firebase stub to set as Adaptor.fire, keeps data in memory.
+
+    The first call of each method sleeps for `slow` seconds, or every call
+    if `every`, before it is applied. Every call raises `error` if given.
+    """
+    def __init__(self, slow=0, error=None, every=False):
+        self.slow = slow
+        self.every = every
+        self.error = error
+        self.calls = [] # (method, url, name, limit of the connection)
+        self.data = {} # key: url/name, value: data
+        self.lock = threading.Lock()
+
+    def _call(self, method, url, name, connection, data=None):
+        with self.lock:
+            self.calls.append((method, url, name, connection.limit))
+            first = len([call for call in self.calls if call[0] == method]) == 1
+        if first or self.every:
+            time.sleep(self.slow)
+        if self.error:
+            raise self.error
+        key = '/'.join([part for part in [url, name] if part])
+        with self.lock:
+            if method == 'post':
+                name = '-K{}'.format(len(self.calls))
+                self.data[key + '/' + name] = data
+                return {'name': name}
+            if method == 'put':
+                self.data[key] = data
+                return data
+            if method == 'delete':
+                self.data.pop(key, None)
+                return None
+            return self.data.get(key)
+
+    def get(self, url, name, connection, params=None, headers=None):
+        return self._call('get', url, name, connection)
+
+    def put(self, url, name, data, connection, params=None, headers=None):
+        return self._call('put', url, name, connection, data)
+
+    def post(self, url, data, connection, params=None, headers=None):
+        return self._call('post', url, None, connection, data)
+
+    def delete(self, url, name, connection, params=None, headers=None):
+        return self._call('delete', url, name, connection)
+
 def drop_db(url):
     # -- setup --
     from sqlalchemy import create_engine
@@ -0,0 +1,89 @@
+import json
+import base64
+import pytest
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from firebase_alchemy.auth import TokenService, AUDIENCE
+from firebase_alchemy.exceptions import ValidationError
+
+EMAIL = 'svc@casual-local.iam.gserviceaccount.com'
+
+class Clock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture(scope='module')
+def private_key():
+    return rsa.generate_private_key(public_exponent=65537,
+                                    key_size=2048,
+                                    backend=default_backend())
+
+@pytest.fixture(scope='module')
+def pem(private_key):
+    return private_key.private_bytes(serialization.Encoding.PEM,
+                                     serialization.PrivateFormat.PKCS8,
+                                     serialization.NoEncryption())
+
+def _decode(segment):
+    return json.loads(base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4)))
+
+def _verify(token, private_key):
+    """check signature and return the payload
+    """
+    header, payload, signature = token.split('.')
+    signature = base64.urlsafe_b64decode(signature + '=' * (-len(signature) % 4))
+    private_key.public_key().verify(signature,
+                                    header + '.' + payload,
+                                    padding.PKCS1v15(),
+                                    hashes.SHA256())
+    assert _decode(header) == {'alg': 'RS256', 'typ': 'JWT'}
+    return _decode(payload)
+
+def test_token_claims(private_key, pem):
+    service = TokenService(EMAIL, pem, clock=Clock(1000))
+    token = service.mint('aaron', paths=['chats/-Kabc', 'chats/-Kdef'],
+                         claims={'premium': True})
+    payload = _verify(token, private_key)
+    assert payload['iss'] == payload['sub'] == EMAIL
+    assert payload['aud'] == AUDIENCE
+    assert payload['uid'] == 'aaron'
+    assert payload['iat'] == 1000
+    assert payload['exp'] == 1000 + 3600
+    assert payload['claims'] == {'premium': True,
+                                 'paths': {'chats': {'-Kabc': True, '-Kdef': True}}}
+    with pytest.raises(ValidationError):
+        service.mint('aaron', claims={'exp': 0})
+
+def test_token_cache(private_key, pem):
+    clock = Clock(1000)
+    service = TokenService(EMAIL, pem, lifetime=600, margin=60, clock=clock)
+    token = service.mint('aaron', paths=['chats/-Kabc'])
+    # same user and claims hit the cache
+    clock.now = 1000 + 539
+    assert service.mint('aaron', paths=['chats/-Kabc']) == token
+    # other user or other claims do not
+    assert service.mint('bill', paths=['chats/-Kabc']) != token
+    assert service.mint('aaron', paths=['chats/-Kdef']) != token
+    # re-mint within margin of expiry
+    clock.now = 1000 + 540
+    token2 = service.mint('aaron', paths=['chats/-Kabc'])
+    assert token2 != token
+    assert _verify(token2, private_key)['exp'] == 1000 + 540 + 600
+
+def test_token_batch_pool(private_key, pem):
+    with TokenService(EMAIL, pem, processes=2, clock=Clock(1000)) as service:
+        grants = [('user{}'.format(i), ['chats/{}'.format(i)]) for i in range(4)]
+        grants.append(grants[0])
+        tokens = service.mint_many(grants)
+        assert service._pool is not None
+    assert service._pool is None
+    assert len(tokens) == 5
+    assert tokens[0] == tokens[4]
+    for i in range(4):
+        payload = _verify(tokens[i], private_key)
+        assert payload['uid'] == 'user{}'.format(i)
+        assert payload['claims'] == {'paths': {'chats': {str(i): True}}}
@@ -0,0 +1,166 @@
+import time
+import threading
+import pytest
+from requests.exceptions import Timeout
+from firebase_alchemy.hedge import Hedger, connection
+from firebase_alchemy.manager import Adaptor
+from firebase_alchemy.scheduler import Scheduler, INTERACTIVE
+from firebase_alchemy.exceptions import DeadlineError
+from _util import Fire
+
+def _attempts(*delays):
+    """an attempt that sleeps delays[n] on its n-th call, and returns n
+    """
+    calls = []
+    lock = threading.Lock()
+    def attempt():
+        with lock:
+            index = len(calls)
+            calls.append(index)
+        time.sleep(delays[index])
+        return index
+    return attempt, calls
+
+def test_hedge_fast_request():
+    hedger = Hedger(delay=0.05)
+    attempt, calls = _attempts(0)
+    assert hedger.run('get', attempt) == 0
+    assert calls == [0]
+    assert hedger.stats == {'requests': 1, 'hedged': 0, 'hedge_wins': 0,
+                            'skipped': 0, 'timeouts': 0}
+
+def test_hedge_slow_request():
+    hedger = Hedger(delay=0.02, max_ratio=1)
+    attempt, calls = _attempts(0.5, 0)
+    start = time.time()
+    assert hedger.run('get', attempt) == 1
+    assert time.time() - start < 0.2
+    assert hedger.stats['hedged'] == 1
+    assert hedger.stats['hedge_wins'] == 1
+    assert hedger.hedge_rate == 1.0
+    assert hedger.win_rate == 1.0
+
+def test_hedge_ratio_and_percentile():
+    hedger = Hedger(delay=0.01, max_ratio=0.5, min_samples=4, percentile=50)
+    attempt, calls = _attempts(0.05, 0.05)
+    hedger.run('get', attempt)
+    # hedge rate is 1/1, next slow request is not hedged
+    assert hedger.stats['hedged'] == 1
+    attempt, calls = _attempts(0.03)
+    hedger.run('get', attempt)
+    assert calls == [0]
+    for latency in [0.1, 0.2, 0.3, 0.4]:
+        hedger._record('put', latency)
+    assert hedger.delay('put') == 0.3
+    assert hedger.delay('get') == 0.01
+
+def test_hedge_deadline():
+    hedger = Hedger(delay=0.01, max_ratio=1)
+    attempt, calls = _attempts(0.5, 0.5)
+    start = time.time()
+    with pytest.raises(DeadlineError):
+        hedger.run('get', attempt, deadline=start + 0.05)
+    assert time.time() - start < 0.2
+    assert hedger.stats['timeouts'] == 1
+    with pytest.raises(DeadlineError):
+        connection(deadline=time.time() - 1)
+    assert connection(deadline=time.time() + 5).limit <= 5
+    assert connection().limit is None
+    # one session shared by all threads
+    sessions = []
+    thread = threading.Thread(target=lambda: sessions.append(connection().session))
+    thread.start()
+    thread.join()
+    assert sessions == [connection().session]
+
+def test_hedge_errors():
+    hedger = Hedger(delay=0.01, max_ratio=1)
+    state = []
+    def attempt():
+        state.append(None)
+        if len(state) == 1:
+            time.sleep(0.05)
+            raise ValueError('primary failed')
+        return 'hedge'
+    # an error waits for the other request
+    assert hedger.run('put', attempt) == 'hedge'
+    def failing():
+        raise ValueError('failed')
+    with pytest.raises(ValueError):
+        hedger.run('put', failing)
+
+def _adaptor(fire, **kwargs):
+    adaptor = Adaptor(None, 'https://casual-local.firebaseio.com/', **kwargs)
+    adaptor.fire = fire
+    return adaptor
+
+def test_adaptor_hedges_get_and_put_only():
+    hedger = Hedger(delay=0.01, max_ratio=1, methods=('get', 'put'))
+    fire = Fire(slow=0.2)
+    adaptor = _adaptor(fire, hedger=hedger)
+    start = time.time()
+    adaptor._call('get', INTERACTIVE, 'test', '-Kabc')
+    adaptor._call('put', INTERACTIVE, 'test', name='-Kabc', data={})
+    assert time.time() - start < 0.2
+    assert hedger.stats['hedged'] == 2
+    # post is never hedged, delete is not either
+    adaptor._call('post', INTERACTIVE, 'test', data={})
+    adaptor._call('delete', INTERACTIVE, 'test', '-Kabc')
+    assert time.time() - start >= 0.4
+    assert hedger.stats['requests'] == 2
+    assert [call[0] for call in fire.calls].count('post') == 1
+
+def test_adaptor_hedged_put_reorders():
+    # put is not hedged unless asked for, a slow write blocks the next one
+    adaptor = _adaptor(Fire(slow=0.1), hedger=Hedger(delay=0.01, max_ratio=1))
+    adaptor._call('put', INTERACTIVE, 'test', name='-Kabc', data='v1')
+    adaptor._call('put', INTERACTIVE, 'test', name='-Kabc', data='v2')
+    assert adaptor.hedger.stats['requests'] == 0
+    assert adaptor.fire.data == {'test/-Kabc': 'v2'}
+    # a hedged put returns with the hedge, its slow first attempt lands
+    # after the next write and overwrites it
+    hedger = Hedger(delay=0.01, max_ratio=1, methods=('get', 'put'))
+    adaptor = _adaptor(Fire(slow=0.1), hedger=hedger)
+    adaptor._call('put', INTERACTIVE, 'test', name='-Kabc', data='v1')
+    adaptor._call('put', INTERACTIVE, 'test', name='-Kabc', data='v2')
+    assert adaptor.fire.data == {'test/-Kabc': 'v2'}
+    time.sleep(0.15)
+    assert hedger.stats['hedge_wins'] == 1
+    assert adaptor.fire.data == {'test/-Kabc': 'v1'}
+    with pytest.raises(Exception):
+        Hedger(methods=('post',))
+
+def test_adaptor_deadline():
+    fire = Fire()
+    adaptor = _adaptor(fire, deadline={'get': 0.5})
+    adaptor._call('get', INTERACTIVE, 'test', None)
+    adaptor._call('post', INTERACTIVE, 'test', data={})
+    assert 0 < fire.calls[0][3] <= 0.5
+    assert fire.calls[1][3] is None
+    # requests timeouts surface as DeadlineError
+    adaptor = _adaptor(Fire(error=Timeout()), deadline=0.5)
+    with pytest.raises(DeadlineError):
+        adaptor._call('post', INTERACTIVE, 'test', data={})
+    assert adaptor.scheduler.in_flight == 0
+    # without a deadline a timeout is not a DeadlineError
+    for hedger in [None, Hedger()]:
+        adaptor = _adaptor(Fire(error=Timeout()), hedger=hedger)
+        with pytest.raises(Timeout):
+            adaptor._call('get', INTERACTIVE, 'test', None)
+
+def test_adaptor_hedge_holds_scheduler_slots():
+    hedger = Hedger(delay=0.01, max_ratio=1)
+    scheduler = Scheduler(window=1)
+    adaptor = _adaptor(Fire(slow=0.1), hedger=hedger, scheduler=scheduler)
+    # window is full, the hedge is skipped
+    adaptor._call('get', INTERACTIVE, 'test', None)
+    assert hedger.stats['hedged'] == 0
+    assert hedger.stats['skipped'] == 1
+    # an attempt still running after the deadline keeps its slot
+    adaptor = _adaptor(Fire(slow=0.2, every=True), hedger=hedger, deadline=0.05,
+                       scheduler=Scheduler(window=4))
+    with pytest.raises(DeadlineError):
+        adaptor._call('get', INTERACTIVE, 'test', None)
+    assert adaptor.scheduler.in_flight == 2
+    time.sleep(0.3)
+    assert adaptor.scheduler.in_flight == 0
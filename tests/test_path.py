@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import pytest
+from firebase_alchemy.path import FirePath, validate_key
+from firebase_alchemy.manager import Adaptor, SyncManager
+from firebase_alchemy.exceptions import ValidationError
+from _util import Fire
+
+def test_firepath_normalize(fire_url):
+    path = FirePath(['/users/', 'chats/'], base=fire_url)
+    assert path.segments == ('users', 'chats')
+    assert path.path == str(path) == 'users/chats'
+    assert path.url == fire_url + 'users/chats'
+    assert path.child('-Kabc') == 'users/chats/-Kabc'
+    assert path.full('-Kabc') == fire_url + 'users/chats/-Kabc'
+    assert path.subpath('-Kabc', 'msg') == 'users/chats/-Kabc/msg'
+    assert path.join('-Kabc') == FirePath('users/chats/-Kabc', base=fire_url)
+    assert FirePath('chats', base=fire_url) == FirePath('/chats/', base=fire_url[:-1])
+    assert len(set([FirePath('chats'), FirePath(['chats'])])) == 1
+
+def test_firepath_immutable():
+    path = FirePath('chats')
+    with pytest.raises(AttributeError):
+        path.path = 'users'
+    with pytest.raises(AttributeError):
+        path.other = 1
+
+def test_firepath_validation():
+    for key in ['a.b', 'a$', '#a', 'a[0]', 'tab\t', u'del\x7f', 'x' * 769]:
+        with pytest.raises(ValidationError):
+            validate_key(key)
+    for path in ['', '/', ['', '/'], 'chats/a.b']:
+        with pytest.raises(ValidationError):
+            FirePath(path)
+    path = FirePath('chats')
+    with pytest.raises(ValidationError):
+        path.subpath('-Kabc', 'a/b')
+    assert validate_key(u'你好-_ :') == u'你好-_ :'
+
+class Chat(object):
+    __firepath__ = 'chats'
+    fireid = '-Kabc'
+
+def test_manager_get_subpath(fire_url):
+    adaptor = Adaptor(None, fire_url)
+    adaptor.fire = Fire()
+    manager = SyncManager(adaptor, Chat)
+    manager.get(Chat())
+    manager.get(Chat(), 'messages/-Kdef/')
+    assert [call[1:3] for call in adaptor.fire.calls] == [('chats/-Kabc', None),
+                                                          ('chats/-Kabc/messages/-Kdef', None)]
+    for subpath in ['messages.x', 'a/$b', 'a/[0]']:
+        with pytest.raises(ValidationError):
+            manager.get(Chat(), subpath)
+    assert len(adaptor.fire.calls) == 2
@@ -0,0 +1,125 @@
+import time
+import threading
+import pytest
+from functools import partial
+from firebase_alchemy.scheduler import Scheduler, INTERACTIVE, BACKGROUND
+from firebase_alchemy.exceptions import DeadlineError
+
+class Response(object):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+class HTTPError(Exception):
+    def __init__(self, status_code, headers=None):
+        super(HTTPError, self).__init__(status_code)
+        self.response = Response(status_code, headers)
+
+def test_scheduler_priority():
+    scheduler = Scheduler(window=1)
+    gate = threading.Event()
+    order = []
+    blocker = threading.Thread(target=scheduler.run,
+                               args=('test', BACKGROUND, gate.wait))
+    blocker.start()
+    while scheduler.in_flight != 1:
+        time.sleep(0.001)
+    threads = []
+    for priority in [BACKGROUND, BACKGROUND, INTERACTIVE]:
+        thread = threading.Thread(target=scheduler.run,
+                                  args=('test', priority, partial(order.append, priority)))
+        thread.start()
+        threads.append(thread)
+        while len(scheduler._waiting) != len(threads):
+            time.sleep(0.001)
+    gate.set()
+    for thread in [blocker] + threads:
+        thread.join()
+    assert order == [INTERACTIVE, BACKGROUND, BACKGROUND]
+    assert scheduler.stats['completed'] == 4
+
+def test_scheduler_rate_limits():
+    scheduler = Scheduler(prefixes={'slow': (20, 1)})
+    start = time.time()
+    for _ in range(5):
+        scheduler.run('fast/abc', INTERACTIVE, lambda: None)
+    assert time.time() - start < 0.05
+    for _ in range(5):
+        scheduler.run('slow/abc', INTERACTIVE, lambda: None)
+    assert time.time() - start >= 0.19
+
+def test_scheduler_throttle_backoff():
+    scheduler = Scheduler(rate=1000, pause=0.05)
+    calls = []
+    def flaky():
+        calls.append(time.time())
+        if len(calls) < 3:
+            raise HTTPError(429 if len(calls) == 1 else 503)
+        return 'ok'
+    assert scheduler.run('test', INTERACTIVE, flaky) == 'ok'
+    # paused 0.05 then 0.1 seconds
+    assert calls[1] - calls[0] >= 0.05
+    assert calls[2] - calls[1] >= 0.1
+    assert scheduler.stats['throttled'] == 2
+    assert scheduler.stats['retried'] == 2
+    assert scheduler.factor < 1.0
+    # out of retries, and other errors are not retried
+    def not_found():
+        raise HTTPError(404)
+    with pytest.raises(HTTPError):
+        scheduler.run('test', INTERACTIVE, not_found)
+    assert scheduler.stats['failed'] == 1
+    def always_throttled():
+        raise HTTPError(429, {'Retry-After': '0'})
+    with pytest.raises(HTTPError):
+        scheduler.run('test', INTERACTIVE, always_throttled)
+    assert scheduler.in_flight == 0
+
+def test_scheduler_deadline():
+    scheduler = Scheduler(rate=10, burst=1)
+    scheduler.run('test', INTERACTIVE, lambda: None)
+    start = time.time()
+    with pytest.raises(DeadlineError):
+        scheduler.run('test', INTERACTIVE, lambda: None, deadline=start + 0.02)
+    assert time.time() - start < 0.05
+    assert not scheduler._waiting
+    assert scheduler.run('test', INTERACTIVE, lambda: 'ok', deadline=time.time() + 1) == 'ok'
+
+def test_scheduler_non_idempotent_retry():
+    scheduler = Scheduler(pause=0)
+    calls = []
+    def post(status):
+        calls.append(status)
+        if len(calls) == 1:
+            raise HTTPError(status)
+        return 'ok'
+    # a 503 may come after the write was applied, do not send again
+    with pytest.raises(HTTPError):
+        scheduler.run('test', INTERACTIVE, partial(post, 503), idempotent=False)
+    assert calls == [503]
+    assert scheduler.stats['throttled'] == 1
+    # a 429 was rejected before it was applied
+    del calls[:]
+    assert scheduler.run('test', INTERACTIVE, partial(post, 429), idempotent=False) == 'ok'
+    assert calls == [429, 429]
+
+def test_scheduler_deadline_wakeup():
+    # a waiter with a deadline is woken by a release right away,
+    # not at the next poll of a timed wait
+    scheduler = Scheduler(window=1)
+    delays = []
+    for _ in range(3):
+        scheduler.acquire('test', INTERACTIVE)
+        started = []
+        waiter = threading.Thread(target=scheduler.run,
+                                  args=('test', INTERACTIVE, lambda: started.append(time.time())),
+                                  kwargs={'deadline': time.time() + 5})
+        waiter.start()
+        while not scheduler._waiting:
+            time.sleep(0.001)
+        time.sleep(0.2) # a timed wait would be polling every 50ms by now
+        released = time.time()
+        scheduler.release()
+        waiter.join()
+        delays.append(started[0] - released)
+    assert sorted(delays)[1] < 0.005